@@ -1,36 +1,302 @@
 import torch
+import torchaudio
 from transformers import Wav2Vec2ForCTC, Wav2Vec2Processor
 import librosa
+import soundfile as sf
 import numpy as np
 from flask import Flask, request, jsonify
 import tempfile
+import atexit
+import io
 import os
 import time
 import re
+import queue
+import threading
+import traceback
+import hashlib
+from collections import OrderedDict
+from concurrent.futures import Future
+
+try:
+    import onnxruntime as ort
+except ImportError:
+    ort = None
+
+try:
+    import blake3
+except ImportError:
+    blake3 = None
+
+try:
+    from faster_whisper import WhisperModel, BatchedInferencePipeline
+except ImportError:
+    WhisperModel = None
 
 # Initialize Flask app
 app = Flask(__name__)
 
-print("Loading Enhanced Wav2Vec2 model...")
-# Using a larger, more accurate model
-model_name = "facebook/wav2vec2-large-960h-lv60-self"  # Much more accurate model
+def _cpu_supports_bf16():
+    """Check whether the CPU has native BF16 kernels (AVX512_BF16 / AMX)"""
+    try:
+        return torch.ops.mkldnn._is_mkldnn_bf16_supported()
+    except Exception:
+        return False
 
-try:
-    processor = Wav2Vec2Processor.from_pretrained(model_name)
-    model = Wav2Vec2ForCTC.from_pretrained(model_name)
-    print("✅ Enhanced model loaded successfully!")
-    print("📊 This model was trained on 960 hours of speech data")
-except Exception as e:
-    print(f"❌ Model loading failed: {e}")
-    print("🔄 Falling back to base model...")
-    model_name = "facebook/wav2vec2-base-960h"
-    processor = Wav2Vec2Processor.from_pretrained(model_name)
-    model = Wav2Vec2ForCTC.from_pretrained(model_name)
+# Opt-in INT8 weights for CPU inference. Only pays off on CPUs with
+# AVX512-VNNI / AMX, so check accuracy on a few samples before enabling.
+USE_INT8 = os.environ.get('TRANSCRIBE_INT8', '0') == '1'
+# Opt-in ONNX Runtime serving of Wav2Vec2 (CPU, or TensorRT on GPU)
+USE_ONNX = os.environ.get('TRANSCRIBE_ONNX', '0') == '1'
+# Opt-in torch.compile of the PyTorch model (slow first requests while it compiles)
+USE_COMPILE = os.environ.get('TRANSCRIBE_COMPILE', '0') == '1'
+# 'wav2vec2' (default) or 'whisper' to serve requests with faster-whisper/CTranslate2
+ASR_BACKEND = os.environ.get('TRANSCRIBE_BACKEND', 'wav2vec2').lower()
+WHISPER_MODEL_SIZE = os.environ.get('TRANSCRIBE_WHISPER_MODEL', 'large-v3')
+# Intra-op threads for the ONNX Runtime session; 0 lets it use every core.
+# gunicorn.conf.py sets this to each worker's share of the cores.
+NUM_THREADS = int(os.environ.get('TRANSCRIBE_NUM_THREADS', '0'))
+
+# Run on the GPU in half precision when available; on CPU only use BF16
+# if the hardware has native support, otherwise stay in FP32
+device = 'cuda' if torch.cuda.is_available() else 'cpu'
+if device == 'cuda':
+    torch.cuda.set_device(0)
+    dtype = torch.float16
+    torch.backends.cudnn.benchmark = True
+elif USE_INT8:
+    # Dynamic quantization expects FP32 activations around the INT8 linears
+    dtype = torch.float32
+elif _cpu_supports_bf16():
+    dtype = torch.bfloat16
+else:
+    dtype = torch.float32
+
+class ArgmaxCTC(torch.nn.Module):
+    """Export wrapper that returns the argmax token ids instead of the full logits"""
+    
+    def __init__(self, ctc_model):
+        super().__init__()
+        self.ctc_model = ctc_model
+    
+    def forward(self, input_values, attention_mask=None):
+        return self.ctc_model(input_values, attention_mask=attention_mask).logits.argmax(dim=-1)
+
+def export_onnx_model(onnx_path):
+    """Export the Wav2Vec2 model to ONNX with dynamic batch and time axes"""
+    # Export a clean FP32 graph: the CPU provider runs it as is and TensorRT
+    # builds its FP16 engine from it (trt_fp16_enable)
+    export_model = ArgmaxCTC(Wav2Vec2ForCTC.from_pretrained(model_name)).eval()
+    dummy_input = torch.zeros(1, 16000, dtype=torch.float32)
+    input_names = ['input']
+    dynamic_axes = {'input': {0: 'b', 1: 't'}, 'pred_ids': {0: 'b', 1: 'frames'}}
+    
+    # Models that expect an attention mask get it as a second graph input for padded batches
+    if feature_extractor.return_attention_mask:
+        dummy_input = (dummy_input, torch.ones(1, 16000, dtype=torch.int64))
+        input_names.append('attention_mask')
+        dynamic_axes['attention_mask'] = {0: 'b', 1: 't'}
+    
+    with torch.no_grad():
+        torch.onnx.export(
+            export_model,
+            dummy_input,
+            onnx_path,
+            opset_version=17,
+            input_names=input_names,
+            output_names=['pred_ids'],
+            dynamic_axes=dynamic_axes
+        )
+    del export_model
+
+def quantize_onnx_model(onnx_path):
+    """Quantize the Linear/MatMul weights of the ONNX model to INT8"""
+    from onnxruntime.quantization import quantize_dynamic, QuantType
+    
+    int8_path = onnx_path.replace('.onnx', '.int8.onnx')
+    if not os.path.exists(int8_path):
+        print("📦 Quantizing ONNX model to INT8 (one-time step)...")
+        quantize_dynamic(onnx_path, int8_path, weight_type=QuantType.QInt8)
+    return int8_path
+
+def load_onnx_session(onnx_path):
+    """Create an ONNX Runtime session: TensorRT FP16 on GPU, the CPU provider otherwise"""
+    available_providers = ort.get_available_providers()
+    # The CUDA provider alone would run the FP32 graph, slower than PyTorch FP16
+    if device == 'cuda' and 'TensorrtExecutionProvider' not in available_providers:
+        raise RuntimeError("TensorRT provider not available, PyTorch FP16 is faster than CUDA FP32")
+    
+    if not os.path.exists(onnx_path):
+        print("📦 Exporting model to ONNX (one-time step)...")
+        export_onnx_model(onnx_path)
+    
+    if device == 'cuda':
+        # CUDA only runs the nodes TensorRT cannot take
+        providers = [
+            ('TensorrtExecutionProvider', {
+                'trt_fp16_enable': True,
+                'trt_engine_cache_enable': True,
+                'trt_engine_cache_path': os.path.dirname(onnx_path)
+            }),
+            'CUDAExecutionProvider',
+        ]
+    else:
+        # INT8 weights only help the CPU provider; GPUs keep the FP16 engine
+        if USE_INT8:
+            onnx_path = quantize_onnx_model(onnx_path)
+        providers = ['CPUExecutionProvider']
+    
+    session_options = ort.SessionOptions()
+    session_options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    session_options.intra_op_num_threads = NUM_THREADS
+    session = ort.InferenceSession(onnx_path, sess_options=session_options, providers=providers)
+    check_onnx_session(session)
+    return session
+
+def build_ort_inputs(input_names, input_values, attention_mask=None):
+    """Build the ONNX Runtime input feed for a batch of model inputs"""
+    ort_inputs = {'input': input_values.numpy()}
+    if 'attention_mask' in input_names:
+        # Unpadded single chunks come without a mask, but the graph always requires one
+        if attention_mask is None:
+            ort_inputs['attention_mask'] = np.ones(input_values.shape, dtype=np.int64)
+        else:
+            ort_inputs['attention_mask'] = attention_mask.numpy().astype(np.int64)
+    return ort_inputs
+
+def check_onnx_session(session):
+    """Run an unpadded single chunk, the input short clips produce, through the session"""
+    input_names = {graph_input.name for graph_input in session.get_inputs()}
+    session.run(None, build_ort_inputs(input_names, torch.zeros(1, 16000, dtype=torch.float32)))
+
+def load_whisper_model():
+    """Load a faster-whisper (CTranslate2) model with INT8 weights"""
+    # INT8 weights with FP16 activations on GPU, pure INT8 (VNNI) kernels on CPU
+    compute_type = 'int8_float16' if device == 'cuda' else 'int8'
+    whisper = WhisperModel(WHISPER_MODEL_SIZE, device=device, compute_type=compute_type)
+    return BatchedInferencePipeline(model=whisper)
+
+whisper_model = None
+if ASR_BACKEND == 'whisper':
+    if WhisperModel is None:
+        print("⚠️ faster-whisper is not installed, using Wav2Vec2")
+    else:
+        print(f"Loading faster-whisper {WHISPER_MODEL_SIZE} model...")
+        try:
+            whisper_model = load_whisper_model()
+            print("✅ Whisper model loaded successfully!")
+        except Exception as e:
+            print(f"❌ Whisper model loading failed, using Wav2Vec2: {e}")
+
+model = None
+ort_session = None
+ort_input_names = set()
+# Shortest clip (in samples at 16kHz) the acoustic model can produce a frame for
+min_input_samples = 1
+if whisper_model is None:
+    print("Loading Enhanced Wav2Vec2 model...")
+    # Using a larger, more accurate model
+    model_name = "facebook/wav2vec2-large-960h-lv60-self"  # Much more accurate model
+
+    try:
+        processor = Wav2Vec2Processor.from_pretrained(model_name)
+        model = Wav2Vec2ForCTC.from_pretrained(model_name, torch_dtype=dtype)
+        print("✅ Enhanced model loaded successfully!")
+        print("📊 This model was trained on 960 hours of speech data")
+    except Exception as e:
+        print(f"❌ Model loading failed: {e}")
+        print("🔄 Falling back to base model...")
+        model_name = "facebook/wav2vec2-base-960h"
+        processor = Wav2Vec2Processor.from_pretrained(model_name)
+        model = Wav2Vec2ForCTC.from_pretrained(model_name, torch_dtype=dtype)
+
+    feature_extractor = processor.feature_extractor
+    # Number of input samples covered by one output frame of the CTC head
+    samples_per_frame = model.config.inputs_to_logits_ratio
+    conv_layers = list(zip(model.config.conv_kernel, model.config.conv_stride))
+    # The conv feature encoder needs at least one receptive field (400 samples) of input
+    for kernel, stride in reversed(conv_layers):
+        min_input_samples = (min_input_samples - 1) * stride + kernel
+
+    # Lookup table for vectorized CTC decoding; the word delimiter becomes a space
+    vocab = processor.tokenizer.get_vocab()
+    id_to_char = np.empty(max(vocab.values()) + 1, dtype=object)
+    id_to_char[:] = ''
+    for token, token_id in vocab.items():
+        id_to_char[token_id] = token
+    id_to_char[processor.tokenizer.word_delimiter_token_id] = ' '
+    pad_token_id = processor.tokenizer.pad_token_id
+
+    # Exported ONNX graph is cached next to the app so the export only runs once
+    ONNX_MODEL_PATH = os.path.join(
+        os.path.dirname(os.path.abspath(__file__)),
+        model_name.split('/')[-1] + "-ids.onnx"
+    )
+
+    if USE_ONNX and ort is None:
+        print("⚠️ TRANSCRIBE_ONNX=1 but onnxruntime is not installed, using PyTorch")
+    elif USE_ONNX:
+        try:
+            ort_session = load_onnx_session(ONNX_MODEL_PATH)
+            ort_input_names = {graph_input.name for graph_input in ort_session.get_inputs()}
+            print(f"🚀 Using ONNX Runtime ({ort_session.get_providers()[0]})")
+        except Exception as e:
+            print(f"⚠️ ONNX Runtime unavailable, using PyTorch: {e}")
+            ort_session = None
+
+    if ort_session is None:
+        # Load the weights once at startup, already on the target device
+        model = model.to(device).eval()
+        if USE_INT8 and device == 'cpu':
+            model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+            print("🗜️ Encoder linear layers quantized to INT8")
+        if USE_COMPILE:
+            # Fuses the encoder's small kernels and, on CUDA, captures them as CUDA graphs
+            model = torch.compile(model, mode="max-autotune", fullgraph=False)
+            print("🧩 Model compiled with torch.compile (max-autotune)")
+        print(f"⚙️ Running on {device.upper()} with {str(dtype).replace('torch.', '')} weights")
+    else:
+        # The ONNX session holds its own copy of the weights
+        model = None
+
+TRANSCRIPTION_ERROR = "Sorry, there was an error processing the audio."
+
+# Fix common transcription errors; keys are matched case-insensitively as whole words
+COMMON_FIXES = {
+    'i': 'I',
+    'im': "I'm",
+    'ive': "I've",
+    'youre': "you're",
+    'were': "we're",
+    'theres': "there's",
+    'dont': "don't",
+    'wont': "won't",
+    'cant': "can't",
+    'shouldnt': "shouldn't",
+    'couldnt': "couldn't",
+    'wouldnt': "wouldn't",
+    'isnt': "isn't",
+    "aren't": "aren't",
+    'wasnt': "wasn't",
+    'werent': "weren't",
+    'havent': "haven't",
+    'hasnt': "hasn't",
+    'hadnt': "hadn't",
+    'doesnt': "doesn't",
+    'didnt': "didn't",
+}
+
+# Compiled once: a single alternation replaces all fixes in one pass over the text
+_FIX_RE = re.compile(
+    r"\b(" + "|".join(map(re.escape, sorted(COMMON_FIXES, key=len, reverse=True))) + r")\b",
+    re.IGNORECASE
+)
+_WS_RE = re.compile(r'\s+')
 
 def clean_transcription(text):
     """Clean and format the transcription for better readability"""
     # Remove extra spaces
-    text = re.sub(r'\s+', ' ', text)
+    text = _WS_RE.sub(' ', text)
     
     # Capitalize first letter of each sentence
     sentences = text.split('. ')
@@ -41,87 +307,378 @@ def clean_transcription(text):
     if text and not text[-1] in ['.', '!', '?']:
         text += '.'
     
-    # Fix common transcription errors - using proper string escaping
-    common_fixes = {
-        r'\bi\b': 'I',
-        r'\bim\b': "I'm",
-        r'\bive\b': "I've",
-        r'\byoure\b': "you're",
-        r'\bwere\b': "we're",
-        r'\btheres\b': "there's",
-        r'\bdont\b': "don't",
-        r'\bwont\b': "won't",
-        r'\bcant\b': "can't",
-        r'\bshouldnt\b': "shouldn't",
-        r'\bcouldnt\b': "couldn't",
-        r'\bwouldnt\b': "wouldn't",
-        r'\bisnt\b': "isn't",
-        r'\baren\'t\b': "aren't",  # Fixed this line
-        r'\bwasnt\b': "wasn't",
-        r'\bwerent\b': "weren't",
-        r'\bhavent\b': "haven't",
-        r'\bhasnt\b': "hasn't",
-        r'\bhadnt\b': "hadn't",
-        r'\bdoesnt\b': "doesn't",
-        r'\bdidnt\b': "didn't",
-    }
-    
-    for pattern, replacement in common_fixes.items():
-        text = re.sub(pattern, replacement, text, flags=re.IGNORECASE)
+    text = _FIX_RE.sub(lambda match: COMMON_FIXES[match.group(1).lower()], text)
     
     return text.strip()
 
-def transcribe_audio(audio_data, sample_rate=16000):
-    """Transcribe audio data to text using Wav2Vec2 model with better processing"""
-    try:
-        # Resample if needed
-        if sample_rate != 16000:
-            audio_data = librosa.resample(audio_data, orig_sr=sample_rate, target_sr=16000)
-        
-        # Normalize audio for better recognition
-        audio_data = audio_data / np.max(np.abs(audio_data))
-        
-        # Process the audio
-        input_values = processor(
-            audio_data, 
-            sampling_rate=16000, 
-            return_tensors="pt",
-            padding=True
-        ).input_values
-        
-        # Get model predictions with attention to detail
-        with torch.no_grad():
-            logits = model(input_values).logits
-        
-        # Get the predicted token ids
-        predicted_ids = torch.argmax(logits, dim=-1)
+def ctc_decode(ids):
+    """Greedy CTC decode: collapse repeated ids, drop blanks and map the rest to characters"""
+    if len(ids) == 0:
+        return ''
+    keep = np.concatenate(([True], ids[1:] != ids[:-1]))
+    ids = ids[keep]
+    ids = ids[ids != pad_token_id]
+    return ''.join(id_to_char[ids]).strip()
+
+def predict_ids(input_values, attention_mask=None):
+    """Run the acoustic model on a padded batch and return the argmax token ids"""
+    if ort_session is not None:
+        ort_inputs = build_ort_inputs(ort_input_names, input_values, attention_mask)
+        # The exported graph already ends in ArgMax, so only the ids leave the device
+        return ort_session.run(None, ort_inputs)[0]
+    
+    # Stage through the pinned host buffer so the H2D copy is an async DMA
+    if pinned_input is not None and input_values.numel() <= pinned_input.numel():
+        staged = pinned_input[:input_values.numel()].view(input_values.shape)
+        staged.copy_(input_values)
+        input_values = staged.to(device, non_blocking=True).to(dtype)
+    else:
+        input_values = input_values.to(device, dtype=dtype, non_blocking=True)
+    if attention_mask is not None:
+        attention_mask = attention_mask.to(device, non_blocking=True)
+    with torch.inference_mode(), torch.autocast(device_type=device, dtype=dtype, enabled=dtype != torch.float32):
+        logits = model(input_values, attention_mask=attention_mask).logits
+    
+    # Get the predicted token ids
+    return torch.argmax(logits, dim=-1).cpu().numpy()
+
+# Micro-batching settings: concurrent requests are grouped for up to
+# MAX_WAIT seconds (or MAX_BATCH items) and run through the model together
+MAX_BATCH = 8
+MAX_WAIT = 0.05
+# Chunks are bucketed by duration (seconds) to keep padding waste low
+DURATION_BUCKETS = (5, 15, 30)
+# Batch sizes a compiled model is padded to, so it only sees a few batch shapes
+COMPILED_BATCH_SIZES = (1, 2, 4, MAX_BATCH)
+
+# Long recordings are split into overlapping windows (in samples at 16kHz)
+CHUNK_LENGTH = 30 * 16000
+CHUNK_OVERLAP = 2 * 16000
+CHUNK_STRIDE = CHUNK_LENGTH - CHUNK_OVERLAP
+
+def duration_bucket(num_samples, sample_rate=16000):
+    """Return the index of the duration bucket an utterance falls into"""
+    duration = num_samples / sample_rate
+    for index, limit in enumerate(DURATION_BUCKETS):
+        if duration < limit:
+            return index
+    return len(DURATION_BUCKETS)
+
+def bucket_length(bucket, sample_rate=16000):
+    """Return the fixed padded length (in samples) for a duration bucket"""
+    return DURATION_BUCKETS[min(bucket, len(DURATION_BUCKETS) - 1)] * sample_rate
+
+def padded_batch_size(num_chunks):
+    """Return the smallest compiled batch size that fits num_chunks"""
+    return next(size for size in COMPILED_BATCH_SIZES if size >= num_chunks)
+
+def split_into_chunks(audio_data):
+    """Split audio into overlapping fixed-length windows, returning their start offsets and samples"""
+    starts = range(0, max(len(audio_data) - CHUNK_OVERLAP, 1), CHUNK_STRIDE)
+    return [(start, audio_data[start:start + CHUNK_LENGTH]) for start in starts]
+
+def feature_frames(num_samples):
+    """Number of CTC frames the conv feature encoder emits for num_samples of real audio"""
+    for kernel, stride in conv_layers:
+        num_samples = (num_samples - kernel) // stride + 1
+    return max(num_samples, 0)
+
+def stitch_chunk_ids(chunk_starts, chunk_ids, chunk_lengths, total_length):
+    """Join per-chunk token ids, cutting each overlap halfway between neighbouring chunks"""
+    stitched = []
+    for index, (start, ids, length) in enumerate(zip(chunk_starts, chunk_ids, chunk_lengths)):
+        keep_from = start + CHUNK_OVERLAP // 2 if index > 0 else start
+        if index + 1 < len(chunk_starts):
+            keep_to = chunk_starts[index + 1] + CHUNK_OVERLAP // 2
+        else:
+            keep_to = total_length
+        # Frames past the chunk's real samples only see padding, so never keep them
+        end_frame = min((keep_to - start) // samples_per_frame, feature_frames(length))
+        stitched.append(ids[(keep_from - start) // samples_per_frame:end_frame])
+    return np.concatenate(stitched)
+
+def prepare_inputs(audio_batch, padded_length=None, batch_size=None):
+    """Normalize and pad 16kHz chunks into model input tensors, bypassing the processor"""
+    # Same zero-mean/unit-variance scaling as Wav2Vec2FeatureExtractor, computed
+    # over each chunk's real samples only. No manual peak scaling is needed first.
+    # Rows past len(audio_batch), up to batch_size, are left as masked-out padding.
+    
+    # Single chunk: normalize one contiguous float32 copy and wrap it without copying
+    if len(audio_batch) == 1 and padded_length is None and batch_size is None:
+        audio_data = np.ascontiguousarray(audio_batch[0], dtype=np.float32)
+        if feature_extractor.do_normalize:
+            audio_data = audio_data - audio_data.mean()
+            audio_data /= np.sqrt(audio_data.var() + 1e-7)
+        return torch.from_numpy(audio_data).unsqueeze(0), None
+    
+    if padded_length is None:
+        padded_length = max(len(audio_data) for audio_data in audio_batch)
+    batch_size = batch_size or len(audio_batch)
+    input_values = np.full((batch_size, padded_length), feature_extractor.padding_value, dtype=np.float32)
+    attention_mask = np.zeros((batch_size, padded_length), dtype=np.int64)
+    
+    for row, audio_data in enumerate(audio_batch):
+        values = input_values[row, :len(audio_data)]
+        values[:] = audio_data
+        if feature_extractor.do_normalize:
+            values -= values.mean()
+            values /= np.sqrt(values.var() + 1e-7)
+        attention_mask[row, :len(audio_data)] = 1
+    
+    attention_mask = torch.from_numpy(attention_mask) if feature_extractor.return_attention_mask else None
+    return torch.from_numpy(input_values), attention_mask
+
+def transcribe_whisper(audio_data):
+    """Transcribe a 16kHz utterance with faster-whisper, batching its segments internally"""
+    # The Wav2Vec2 checkpoints are English-only, so keep the same language and skip detection
+    segments, _ = whisper_model.transcribe(audio_data, language='en', beam_size=5, batch_size=MAX_BATCH)
+    
+    # Whisper already outputs cased, punctuated text; only tidy up the whitespace
+    return _WS_RE.sub(' ', ' '.join(segment.text.strip() for segment in segments)).strip()
+
+def transcribe_batch(audio_batch):
+    """Transcribe a list of 16kHz utterances, running their chunks through the model in batches"""
+    if whisper_model is not None:
+        return [transcribe_whisper(audio_data) for audio_data in audio_batch]
+    
+    # Split every utterance into windows; chunk_starts[i] holds the offsets of utterance i's windows
+    chunks = []
+    chunk_starts = []
+    for audio_data in audio_batch:
+        windows = split_into_chunks(audio_data)
+        chunk_starts.append([start for start, _ in windows])
+        chunks.extend(chunk for _, chunk in windows)
+    
+    # Group similar-length chunks so each forward pass pads as little as possible
+    buckets = {}
+    for position, chunk in enumerate(chunks):
+        buckets.setdefault(duration_bucket(len(chunk)), []).append(position)
+    
+    chunk_ids = [None] * len(chunks)
+    for bucket, positions in buckets.items():
+        # A compiled graph is specialized per input shape, so pad to the bucket's
+        # fixed length (and below, to a fixed batch size) to keep the number of
+        # compiled variants small. The group-norm base checkpoint takes no
+        # attention mask, so this extra padding slightly changes its output.
+        compiled = USE_COMPILE and model is not None
+        padded_length = bucket_length(bucket) if compiled else None
         
-        # Decode the audio to text
-        transcription = processor.batch_decode(predicted_ids)[0]
+        for offset in range(0, len(positions), MAX_BATCH):
+            group = positions[offset:offset + MAX_BATCH]
+            
+            # Process the audio, padding every chunk in the group to the same length
+            input_values, attention_mask = prepare_inputs(
+                [chunks[position] for position in group],
+                padded_length,
+                padded_batch_size(len(group)) if compiled else None
+            )
+            
+            # Get model predictions with attention to detail
+            predicted_ids = predict_ids(input_values, attention_mask)
+            for position, ids in zip(group, predicted_ids):
+                chunk_ids[position] = ids
+    
+    # Stitch each utterance back together; CTC collapse removes repeats across the seams
+    transcriptions = []
+    position = 0
+    for audio_data, starts in zip(audio_batch, chunk_starts):
+        lengths = [len(chunk) for chunk in chunks[position:position + len(starts)]]
+        ids = stitch_chunk_ids(starts, chunk_ids[position:position + len(starts)], lengths, len(audio_data))
+        position += len(starts)
+        transcriptions.append(clean_transcription(ctc_decode(ids)))
+    return transcriptions
+
+# Formats libsndfile decodes natively (MP3 and Opus need libsndfile >= 1.1);
+# everything else goes through torchaudio (FFmpeg via torchcodec from 2.9 on)
+SOUNDFILE_EXTENSIONS = {'.wav', '.flac', '.ogg', '.mp3', '.opus'}
+# FFmpeg demuxer names where they differ from the file extension
+FFMPEG_FORMATS = {'.opus': 'ogg'}
+
+def resample_audio(audio_data, orig_sr, target_sr=16000):
+    """Resample float32 audio with torchaudio's vectorized resampler"""
+    if orig_sr == target_sr:
+        return audio_data
+    return torchaudio.functional.resample(torch.from_numpy(audio_data), orig_sr, target_sr).numpy()
+
+def load_audio(audio_bytes, file_ext, target_sr=16000):
+    """Decode uploaded audio bytes in memory to mono float32 samples at the target sample rate"""
+    try:
+        if file_ext in SOUNDFILE_EXTENSIONS:
+            audio_data, sample_rate = sf.read(io.BytesIO(audio_bytes), dtype='float32', always_2d=False)
+            if audio_data.ndim > 1:
+                audio_data = audio_data.mean(axis=1)
+        else:
+            audio_format = FFMPEG_FORMATS.get(file_ext, file_ext[1:])
+            waveform, sample_rate = torchaudio.load(io.BytesIO(audio_bytes), format=audio_format)
+            audio_data = waveform.mean(dim=0).numpy()
+    except Exception as e:
+        print(f"⚠️ In-memory decode of {file_ext} failed, falling back to librosa: {e}")
+        return load_audio_from_temp_file(audio_bytes, file_ext, target_sr)
+    
+    return resample_audio(audio_data, sample_rate, target_sr), target_sr
+
+def load_audio_from_temp_file(audio_bytes, file_ext, target_sr=16000):
+    """Last-resort decode through librosa's audioread fallback, which needs a real file path"""
+    with tempfile.NamedTemporaryFile(suffix=file_ext, delete=False) as temp_file:
+        temp_file.write(audio_bytes)
+    try:
+        return librosa.load(temp_file.name, sr=target_sr)
+    finally:
+        # Always try to clean up the temporary file
+        safe_delete_file(temp_file.name)
+
+def warmup_model():
+    """Run dummy forward passes so CUDA context setup and kernel autotuning happen at startup"""
+    transcribe_batch([np.zeros(16000, dtype=np.float32)])
+    
+    # Compile every padded shape up front instead of on the first request that hits it
+    if USE_COMPILE and model is not None:
+        for bucket in range(len(DURATION_BUCKETS)):
+            for batch_size in COMPILED_BATCH_SIZES:
+                predict_ids(*prepare_inputs([np.zeros(16000, dtype=np.float32)], bucket_length(bucket), batch_size))
+
+class TranscriptionBatcher:
+    """Collects concurrent transcription requests and runs them in batches"""
+    
+    def __init__(self, max_batch=MAX_BATCH, max_wait=MAX_WAIT):
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.requests = queue.Queue()
+        self.lock = threading.Lock()
+        self.worker = None
+    
+    def start(self):
+        """Start the worker thread if it is not running in this process yet"""
+        # Threads do not survive a fork, so each gunicorn worker starts its own
+        with self.lock:
+            if self.worker is None or not self.worker.is_alive():
+                self.worker = threading.Thread(target=self._run, name="transcription-batcher", daemon=True)
+                self.worker.start()
+    
+    def submit(self, audio_data, sample_rate=16000):
+        """Queue audio for transcription and return a Future with the text"""
+        self.start()
         
-        # Clean and format the transcription
-        cleaned_transcription = clean_transcription(transcription)
+        # Resample on the request thread so the worker only runs the model
+        if sample_rate != 16000:
+            audio_data = resample_audio(audio_data, sample_rate)
         
-        return cleaned_transcription
+        future = Future()
+        self.requests.put((audio_data, future))
+        return future
+    
+    def _collect(self):
+        """Block for one request, then gather more until the batch is full or the wait expires"""
+        batch = [self.requests.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.requests.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+    
+    def _run(self):
+        # Warm up inside the serving process, after any fork, before taking requests
+        print("🔥 Warming up model...")
+        try:
+            warmup_model()
+        except Exception:
+            # Keep serving so queued requests get an error reply instead of hanging,
+            # but log the full traceback: this usually means the backend is broken
+            print("❌ Warm-up failed, requests are likely to fail too:")
+            traceback.print_exc()
         
-    except Exception as e:
-        print(f"Transcription error: {e}")
-        return "Sorry, there was an error processing the audio."
-
-def safe_delete_file(file_path, max_retries=5, delay=0.1):
-    """Safely delete a file with retries to handle Windows file locking"""
-    for i in range(max_retries):
+        while True:
+            items = self._collect()
+            if len(items) == 1:
+                transcriptions = [self._transcribe_single(items[0][0])]
+            else:
+                try:
+                    transcriptions = transcribe_batch([audio_data for audio_data, _ in items])
+                except Exception:
+                    # Retry each request on its own so one bad input cannot fail its neighbours
+                    transcriptions = [self._transcribe_single(audio_data) for audio_data, _ in items]
+            for (_, future), transcription in zip(items, transcriptions):
+                future.set_result(transcription)
+    
+    def _transcribe_single(self, audio_data):
+        """Transcribe one utterance, returning the error message if it fails"""
         try:
-            if os.path.exists(file_path):
+            return transcribe_batch([audio_data])[0]
+        except Exception:
+            print("Transcription error:")
+            traceback.print_exc()
+            return TRANSCRIPTION_ERROR
+
+# Page-locked host buffer large enough for a full batch of chunks; only the
+# batcher thread runs the model, so one buffer is reused for every batch
+pinned_input = None
+if device == 'cuda' and model is not None:
+    pinned_input = torch.empty(MAX_BATCH * CHUNK_LENGTH, dtype=torch.float32, pin_memory=True)
+
+batcher = TranscriptionBatcher()
+
+# Temp files Windows would not let us delete yet; retried later instead of sleeping
+pending_deletions = set()
+pending_deletions_lock = threading.Lock()
+
+def delete_pending_files():
+    """Try once to delete every pending temp file, keeping the ones that are still locked"""
+    with pending_deletions_lock:
+        for file_path in list(pending_deletions):
+            try:
                 os.unlink(file_path)
-                return True
-        except PermissionError:
-            if i < max_retries - 1:
-                time.sleep(delay)
-            else:
-                print(f"⚠️ Warning: Could not delete temporary file: {file_path}")
-                return False
-    return False
+            except FileNotFoundError:
+                pass
+            except OSError:
+                # Locked or otherwise undeletable for now; keep it for the next attempt
+                continue
+            pending_deletions.discard(file_path)
+
+def safe_delete_file(file_path):
+    """Delete a file without blocking; files still locked on Windows are retried on later calls and at exit"""
+    with pending_deletions_lock:
+        pending_deletions.add(file_path)
+    delete_pending_files()
+    with pending_deletions_lock:
+        deleted = file_path not in pending_deletions
+    if not deleted:
+        # Warn once here; later retries of the same file stay quiet
+        print(f"⚠️ Warning: Could not delete temporary file yet, will retry: {file_path}")
+    return deleted
+
+atexit.register(delete_pending_files)
+
+# Recently transcribed uploads, keyed by a hash of the file bytes (per process)
+TRANSCRIPTION_CACHE_SIZE = 1024
+transcription_cache = OrderedDict()
+transcription_cache_lock = threading.Lock()
+
+def audio_digest(audio_bytes):
+    """Hash uploaded bytes with BLAKE3 when installed, otherwise hashlib's BLAKE2b"""
+    if blake3 is not None:
+        return blake3.blake3(audio_bytes).hexdigest()
+    return hashlib.blake2b(audio_bytes).hexdigest()
+
+def get_cached_transcription(digest):
+    """Return the cached (transcription, duration) for an upload, or None"""
+    with transcription_cache_lock:
+        result = transcription_cache.get(digest)
+        if result is not None:
+            transcription_cache.move_to_end(digest)
+        return result
+
+def cache_transcription(digest, result):
+    """Store a (transcription, duration) pair, evicting the least recently used entry"""
+    with transcription_cache_lock:
+        transcription_cache[digest] = result
+        transcription_cache.move_to_end(digest)
+        if len(transcription_cache) > TRANSCRIPTION_CACHE_SIZE:
+            transcription_cache.popitem(last=False)
 
 @app.route('/')
 def home():
@@ -571,7 +1128,6 @@ def home():
 
 @app.route('/transcribe', methods=['POST'])
 def transcribe_endpoint():
-    temp_file_path = None
     try:
         if 'audio' not in request.files:
             return jsonify({'error': 'No audio file provided'}), 400
@@ -587,35 +1143,46 @@ def transcribe_endpoint():
         if file_ext not in allowed_extensions:
             return jsonify({'error': f'File type {file_ext} not supported. Use: WAV, MP3, FLAC, M4A, OPUS, OGG'}), 400
 
-        # Create temporary file with unique name
-        temp_file_path = tempfile.mktemp(suffix=file_ext)
-        audio_file.save(temp_file_path)
-        
-        # Load and process the audio file
-        try:
-            audio_data, sample_rate = librosa.load(temp_file_path, sr=16000)
-        except Exception as e:
-            return jsonify({'error': f'Error loading audio file: {str(e)}'}), 400
+        # Re-uploads of the same file are answered from the cache
+        audio_bytes = audio_file.read()
+        digest = audio_digest(audio_bytes)
+        cached = get_cached_transcription(digest)
         
-        # Transcribe the audio with enhanced model
-        transcription = transcribe_audio(audio_data, sample_rate)
+        if cached is not None:
+            transcription, audio_duration = cached
+        else:
+            # Load and process the audio file straight from the upload
+            try:
+                audio_data, sample_rate = load_audio(audio_bytes, file_ext)
+            except Exception as e:
+                return jsonify({'error': f'Error loading audio file: {str(e)}'}), 400
+            
+            if len(audio_data) < min_input_samples:
+                return jsonify({'error': 'Audio file is too short to transcribe'}), 400
+            
+            # Transcribe the audio with enhanced model (batched with concurrent requests)
+            transcription = batcher.submit(audio_data, sample_rate).result()
+            audio_duration = f"{len(audio_data)/sample_rate:.2f} seconds"
+            
+            # Failed transcriptions are not cached so a retry runs the model again
+            if transcription != TRANSCRIPTION_ERROR:
+                cache_transcription(digest, (transcription, audio_duration))
         
         return jsonify({
             'status': 'success',
             'transcription': transcription,
-            'audio_duration': f"{len(audio_data)/sample_rate:.2f} seconds",
+            'audio_duration': audio_duration,
             'filename': audio_file.filename
         })
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
-    finally:
-        # Always try to clean up the temporary file
-        if temp_file_path and os.path.exists(temp_file_path):
-            safe_delete_file(temp_file_path)
 
 if __name__ == '__main__':
+    # Development server only; for production use: gunicorn -c gunicorn.conf.py app:app
     print("🚀 Starting Enhanced Transcription Server...")
     print("📱 Open http://127.0.0.1:5000 in your browser")
     print("🎯 Using high-accuracy Wav2Vec2 Large model")
-    app.run(debug=True, host='127.0.0.1', port=5000)
\ No newline at end of file
+    batcher.start()
+    # The reloader would load the model a second time in a child process
+    app.run(debug=True, use_reloader=False, host='127.0.0.1', port=5000)
\ No newline at end of file
@@ -0,0 +1,44 @@
+"""Gunicorn settings for the transcription server
+
+Run with: gunicorn -c gunicorn.conf.py app:app
+"""
+import multiprocessing
+import os
+
+# Query CUDA through NVML so the master process does not initialize CUDA before forking
+os.environ.setdefault('PYTORCH_NVML_BASED_CUDA_CHECK', '1')
+import torch
+
+bind = os.environ.get('TRANSCRIBE_BIND', '127.0.0.1:5000')
+worker_class = 'gthread'
+# Long uploads on CPU can take minutes to transcribe
+timeout = 300
+
+if torch.cuda.is_available():
+    # A single process owns the GPU; its threads feed the in-process batcher,
+    # so allow enough of them to fill a batch. CUDA cannot be forked, so the
+    # model is loaded inside the worker.
+    workers = 1
+    threads = 8
+    preload_app = False
+else:
+    workers = int(os.environ.get('WEB_CONCURRENCY', min(4, multiprocessing.cpu_count())))
+    threads = 2
+    # Load the model once in the master; forked workers share the weight
+    # pages copy-on-write instead of each holding a private copy
+    preload_app = True
+
+# Split the cores between workers instead of every worker using all of them.
+# Set before the app is preloaded so the ONNX Runtime session, created in the
+# master, sizes its intra-op pool the same way.
+os.environ.setdefault('TRANSCRIBE_NUM_THREADS', str(max(1, multiprocessing.cpu_count() // workers)))
+
+
+def post_fork(server, worker):
+    torch.set_num_threads(int(os.environ['TRANSCRIBE_NUM_THREADS']))
+
+
+def post_worker_init(worker):
+    # Start the batcher (and its warm-up pass) before the first request arrives
+    from app import batcher
+    batcher.start()